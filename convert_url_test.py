@@ -1,6 +1,7 @@
 """
 Script para convertir URLs de share.google a URLs completas de Google Maps
-Usa Selenium para seguir la redirección y capturar la URL final
+Sigue la redirección HTTP directamente; Selenium solo se usa como respaldo
+cuando la redirección es por JavaScript
 
 Uso:
     uv run python convert_url_test.py
@@ -12,65 +13,156 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 from webdriver_manager.chrome import ChromeDriverManager
-import time
+from typing import List, Optional
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 
-def convert_share_url_to_maps_url(share_url: str, timeout: int = 10) -> str:
+MAPS_HOST = "google.com/maps"
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"}
+
+
+def follow_redirects(share_url: str, timeout: int = 10) -> Optional[str]:
+    """
+    Sigue la cadena de redirecciones HTTP (301/302) sin navegador
+
+    Returns:
+        URL final tras las redirecciones (None si hubo error)
+    """
+    try:
+        with urlopen(Request(share_url, headers=HTTP_HEADERS), timeout=timeout) as response:
+            return response.geturl()
+    except Exception as e:
+        print(f"⚠️  Redirección HTTP falló para {share_url}: {e}")
+        return None
+
+
+class UrlConverter:
+    """
+    Mantiene un único Chrome headless y lo reutiliza para convertir varias URLs
+    (lanzar Chrome cuesta segundos; la redirección en sí, milisegundos)
+
+    Uso:
+        with UrlConverter() as converter:
+            maps_url = converter.convert(share_url)
+    """
+
+    def __init__(self, timeout: int = 10):
+        self.timeout = timeout
+        self._driver = None
+
+    def _get_driver(self):
+        if self._driver is None:
+            # Configurar Chrome en modo headless (sin ventana visible)
+            chrome_options = Options()
+            chrome_options.add_argument("--headless")
+            chrome_options.add_argument("--no-sandbox")
+            chrome_options.add_argument("--disable-dev-shm-usage")
+            chrome_options.add_argument("--disable-gpu")
+            chrome_options.add_argument("--window-size=1920,1080")
+
+            service = Service(ChromeDriverManager().install())
+            self._driver = webdriver.Chrome(service=service, options=chrome_options)
+        return self._driver
+
+    def convert(self, share_url: str) -> Optional[str]:
+        """
+        Convierte una URL de share.google a una URL completa de Google Maps
+
+        Args:
+            share_url: URL en formato https://share.google/...
+
+        Returns:
+            URL completa de Google Maps (None si hubo error)
+        """
+        print(f"🔄 Abriendo URL: {share_url}")
+
+        try:
+            driver = self._get_driver()
+
+            # Abrir la URL corta
+            driver.get(share_url)
+
+            # Esperar a que la URL cambie a google.com/maps (redirección completa)
+            try:
+                WebDriverWait(driver, self.timeout).until(EC.url_contains(MAPS_HOST))
+                print(f"✅ Redirección completa detectada")
+            except TimeoutException:
+                print(f"⏳ Sin redirección tras {self.timeout}s (URL actual: {driver.current_url[:50]}...)")
+
+            # Obtener la URL final
+            final_url = driver.current_url
+
+            print(f"📍 URL final: {final_url}")
+
+            return final_url
+
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            return None
+
+    def close(self):
+        if self._driver is not None:
+            self._driver.quit()
+            self._driver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# Conversor Selenium de respaldo, compartido y creado solo si hace falta; se cierra al salir
+_converter: Optional[UrlConverter] = None
+
+
+def convert_share_url_to_maps_url(share_url: str, timeout: int = 10) -> Optional[str]:
     """
     Convierte una URL de share.google a una URL completa de Google Maps
-    
+
     Args:
         share_url: URL en formato https://share.google/...
         timeout: Segundos máximos de espera
-        
+
     Returns:
         URL completa de Google Maps
     """
-    # Configurar Chrome en modo headless (sin ventana visible)
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920,1080")
-    
-    # Inicializar driver
-    print(f"🔄 Abriendo URL: {share_url}")
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=chrome_options)
-    
-    try:
-        # Abrir la URL corta
-        driver.get(share_url)
-        
-        # Esperar un poco para la redirección
-        time.sleep(3)
-        
-        # Esperar a que la URL cambie (redirección completa)
-        wait = WebDriverWait(driver, timeout)
-        
-        # La URL debería cambiar a google.com/maps
-        for _ in range(5):  # Intentar 5 veces
-            current_url = driver.current_url
-            if "google.com/maps" in current_url:
-                print(f"✅ Redirección completa detectada")
-                break
-            print(f"⏳ Esperando redirección... (URL actual: {current_url[:50]}...)")
-            time.sleep(2)
-        
-        # Obtener la URL final
-        final_url = driver.current_url
-        
+    print(f"🔄 Siguiendo redirección: {share_url}")
+    final_url = follow_redirects(share_url, timeout)
+    if final_url and MAPS_HOST in final_url:
         print(f"📍 URL final: {final_url}")
-        
         return final_url
-        
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        return None
-        
-    finally:
-        driver.quit()
+
+    # Redirección por JavaScript: respaldo con Selenium
+    return _selenium_convert(share_url, timeout)
+
+
+def convert_share_urls(share_urls: List[str], timeout: int = 10) -> List[Optional[str]]:
+    """
+    Convierte varias URLs lanzando las peticiones HTTP en paralelo
+
+    Returns:
+        URLs de Google Maps en el mismo orden que share_urls
+    """
+    # Hilos en vez de asyncio.run, que falla si ya hay un event loop corriendo (Jupyter)
+    with ThreadPoolExecutor() as executor:
+        final_urls = list(executor.map(follow_redirects, share_urls, [timeout] * len(share_urls)))
+    return [
+        final_url if final_url and MAPS_HOST in final_url else _selenium_convert(url, timeout)
+        for url, final_url in zip(share_urls, final_urls)
+    ]
+
+
+def _selenium_convert(share_url: str, timeout: int) -> Optional[str]:
+    global _converter
+    if _converter is None:
+        _converter = UrlConverter(timeout)
+        atexit.register(_converter.close)
+    _converter.timeout = timeout
+    return _converter.convert(share_url)
 
 
 if __name__ == "__main__":
@@ -2,7 +2,9 @@ import argparse
 from typing import Optional
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 import hashlib
+from pyarrow import csv as pa_csv
 from pathlib import Path
 
 CANON_MAP = {
@@ -13,29 +15,57 @@ CANON_MAP = {
     "Midtown East": "Midtown",
 }
 
-def _make_composite_key(row) -> str:
-    parts = [
-        str(row.get("review_id", "")),
-        str(row.get("restaurant_name", "")),
-        str(row.get("reviewer_name", "")),
-        str(row.get("review_text", "")),
-        str(row.get("published_timestamp", "")),
-    ]
-    return hashlib.md5("||".join(parts).encode("utf-8", errors="ignore")).hexdigest()
+# Equivalente RE2 (Arrow) de \s en Python: RE2 solo cubre [\t\n\f\r ] con \s
+WS_PATTERN = r"[\s\x0b\x1c-\x1f\x85\p{Z}]+"
+
+KEY_COLS = ["review_id", "restaurant_name", "reviewer_name", "review_text", "published_timestamp"]
+
+def _review_keys(df: pd.DataFrame) -> pd.Series:
+    # MD5 estable entre corridas de la llave compuesta; faltantes/NA -> ""
+    cols = df.reindex(columns=KEY_COLS).astype(pd.ArrowDtype(pa.string())).fillna("")
+    joined = cols[KEY_COLS[0]].str.cat([cols[c] for c in KEY_COLS[1:]], sep="||").to_numpy()
+    return pd.Series(
+        [hashlib.md5(s.encode("utf-8", errors="ignore")).hexdigest() for s in joined],
+        index=df.index,
+    )
 
 def _ts_to_datetime(series: pd.Series) -> pd.Series:
-    ts = pd.to_numeric(series, errors="coerce")
-    use_ms = (ts.dropna() > 10**12).mean() > 0.5  # heurística: ms si la mayoría > 1e12
+    ts = pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    n_valid = np.count_nonzero(~np.isnan(ts))
+    use_ms = np.count_nonzero(ts > 10**12) > 0.5 * n_valid  # heurística: ms si la mayoría > 1e12
     unit = "ms" if use_ms else "s"
-    return pd.to_datetime(ts, unit=unit, utc=True, errors="coerce")
-
-def clean_reviews(input_csv: str, output_csv: str, dict_md: Optional[str] = None) -> pd.DataFrame:
-    df_raw = pd.read_csv(input_csv, low_memory=False)
+    return pd.Series(pd.to_datetime(ts, unit=unit, utc=True, errors="coerce"), index=series.index)
+
+def _read_reviews(path: str) -> pd.DataFrame:
+    if Path(path).suffix == ".parquet":
+        return pd.read_parquet(path, engine="pyarrow", dtype_backend="pyarrow")
+    # Las reseñas traen saltos de línea dentro de campos entre comillas; el lector
+    # multihilo de pyarrow solo los acepta con newlines_in_values (pandas no lo expone)
+    table = pa_csv.read_csv(
+        path,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(strings_can_be_null=True),  # "" -> NA, como pandas
+    )
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+def clean_reviews(
+    input_csv: str,
+    output_csv: str,
+    dict_md: Optional[str] = None,
+    output_format: str = "csv",
+    review_key: bool = False,
+) -> pd.DataFrame:
+    df_raw = _read_reviews(input_csv)
 
     # --- Deduplicación por llave compuesta (robusta ante faltantes)
-    key = df_raw.apply(_make_composite_key, axis=1)
-    n_dupes = int(key.duplicated().sum())
-    df = df_raw.loc[~key.duplicated()].copy()
+    subset = [c for c in KEY_COLS if c in df_raw.columns]
+    dup_mask = df_raw.duplicated(subset=subset, keep="first")
+    n_dupes = int(dup_mask.sum())
+    df = df_raw.loc[~dup_mask].copy()
+
+    # --- ID estable por reseña (opcional; la deduplicación no lo necesita)
+    if review_key:
+        df["review_key"] = _review_keys(df)
 
     # --- Tipos numéricos/booleanos
     for col in ["rating", "likes_count", "reviewer_total_reviews"]:
@@ -43,30 +73,49 @@ def clean_reviews(input_csv: str, output_csv: str, dict_md: Optional[str] = None
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
     if "is_local_guide" in df.columns:
-        df["is_local_guide"] = (
-            df["is_local_guide"].astype(str).strip().str.lower().map({"true": True, "false": False})
-        )
+        s = df["is_local_guide"].astype("string").str.strip().str.lower()
+        is_true = (s == "true").to_numpy(dtype=bool, na_value=False)
+        is_false = (s == "false").to_numpy(dtype=bool, na_value=False)
+        # Tri-estado: True/False/NA para cualquier otro valor
+        df["is_local_guide"] = pd.arrays.BooleanArray(is_true, ~(is_true | is_false))
 
     # --- Fechas: timestamp -> UTC + derivadas
     if "published_timestamp" in df.columns:
         dt = _ts_to_datetime(df["published_timestamp"])
         df["review_datetime_utc"] = dt
-        df["review_date"] = df["review_datetime_utc"].dt.date
-        df["review_year"] = df["review_datetime_utc"].dt.year
-        df["review_month"] = df["review_datetime_utc"].dt.month
+        # Derivadas en una pasada sobre el buffer datetime64 (UTC, sin zona)
+        dt64 = dt.to_numpy(dtype="datetime64[ns]")
+        nat = np.isnat(dt64)
+        months = dt64.astype("datetime64[M]").astype("int64")  # meses desde 1970-01
+        df["review_date"] = pd.arrays.ArrowExtensionArray(pa.array(dt64.astype("datetime64[D]"), from_pandas=True))
+        df["review_year"] = pd.arrays.IntegerArray(months // 12 + 1970, nat)
+        df["review_month"] = pd.arrays.IntegerArray(months % 12 + 1, nat)
 
     # --- Texto: limpieza básica
     if "review_text" in df.columns:
-        df["review_text"] = df["review_text"].astype(str).str.replace(r"\s+", " ", regex=True).str.strip()
+        text = df["review_text"].astype(pd.ArrowDtype(pa.string()))
+        df["review_text"] = text.str.replace(WS_PATTERN, " ", regex=True).str.strip()
 
     # --- Barrio normalizado + canónico (opcional)
     if "neighborhood" in df.columns:
-        df["neighborhood_norm"] = df["neighborhood"].astype(str).str.strip()
-        df["neighborhood_canon"] = df["neighborhood_norm"].replace(CANON_MAP)
+        norm = df["neighborhood"].astype(pd.ArrowDtype(pa.string())).str.strip()
+        df["neighborhood_norm"] = norm
+        # Búsqueda exacta en el dict; lo que no está en CANON_MAP se conserva
+        df["neighborhood_canon"] = norm.map(CANON_MAP).astype(norm.dtype).fillna(norm)
 
     # --- Guardado
     Path(output_csv).parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(output_csv, index=False)
+    if output_format == "parquet":
+        # Columnar + zstd: conserva tipos, sin re-parseo aguas abajo
+        df.to_parquet(
+            Path(output_csv).with_suffix(".parquet"),
+            engine="pyarrow",
+            compression="zstd",
+            row_group_size=64_000,
+            index=False,
+        )
+    else:
+        pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), output_csv)
 
     # --- Diccionario de datos (opcional)
     if dict_md:
@@ -97,6 +146,7 @@ def _write_data_dictionary(df: pd.DataFrame, path_md: str) -> None:
         "owner_response": "Respuesta del propietario (si existe).",
         "review_id": "ID único de la reseña (si existe).",
         "review_url": "URL directa a la reseña.",
+        "review_key": "Hash MD5 estable de la llave compuesta (solo con --review-key).",
         "review_datetime_utc": "Fecha-hora en UTC derivada del timestamp.",
         "review_date": "Fecha (YYYY-MM-DD) derivada.",
         "review_year": "Año de la reseña (derivado).",
@@ -121,5 +171,15 @@ if __name__ == "__main__":
     ap.add_argument("--in", dest="input_csv", required=True)
     ap.add_argument("--out", dest="output_csv", required=True)
     ap.add_argument("--dict", dest="dict_md", default=None, help="Ruta para escribir data dictionary .md")
+    ap.add_argument("--format", dest="output_format", choices=["csv", "parquet"], default="csv",
+                    help="Formato de salida (parquet usa compresión zstd)")
+    ap.add_argument("--review-key", dest="review_key", action="store_true",
+                    help="Agregar columna review_key (MD5 de la llave compuesta)")
     args = ap.parse_args()
-    clean_reviews(args.input_csv, args.output_csv, dict_md=args.dict_md)
+    clean_reviews(
+        args.input_csv,
+        args.output_csv,
+        dict_md=args.dict_md,
+        output_format=args.output_format,
+        review_key=args.review_key,
+    )
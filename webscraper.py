@@ -6,14 +6,24 @@ Collects 2,000+ reviews across different neighborhoods for bias analysis
 FIXED VERSION - Corrected dataset iteration issue
 """
 
-from apify_client import ApifyClient
+from apify_client import ApifyClientAsync
+from apify_client.errors import ApifyApiError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv as pa_csv
 import json
+import orjson
 import time
 from typing import List, Dict, Optional
 import random
+import re
+from enum import IntEnum
 import logging
 import os
+import asyncio
+import hashlib
 
 # Configure logging
 logging.basicConfig(
@@ -23,6 +33,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Dataset items are paged and converted to Arrow in chunks of this size
+REVIEW_CHUNK_SIZE = 1000
+
+# Apify bills the reviews actor at ~$0.50 per 1,000 reviews; used to estimate credits left
+COST_PER_1000_REVIEWS = 0.50
+# Score (in $) a token loses for each actor run it already has in flight
+INFLIGHT_PENALTY = 0.5
+
+# Scraped restaurants are cached here so re-runs don't pay for the same actor run twice
+CACHE_DIR = os.path.join(".cache", "apify")
+CACHE_TTL_DAYS = 7
+
+# Output schema for one review row (column order matches the CSV output)
+REVIEW_SCHEMA = pa.schema([
+    ('restaurant_name', pa.string()),
+    ('neighborhood', pa.string()),
+    ('cuisine_type', pa.string()),
+    ('place_url', pa.string()),
+    ('reviewer_name', pa.string()),
+    ('rating', pa.float64()),
+    ('review_text', pa.string()),
+    ('review_text_translated', pa.string()),
+    ('review_length', pa.int64()),
+    ('published_date', pa.string()),
+    ('published_timestamp', pa.string()),
+    ('likes_count', pa.int64()),
+    ('reviewer_total_reviews', pa.int64()),
+    ('is_local_guide', pa.bool_()),
+    ('owner_response', pa.string()),
+    ('review_id', pa.string()),
+    ('review_url', pa.string()),
+])
+
+# Columns with a handful of distinct values repeated on every row; stored dictionary-encoded
+DICTIONARY_COLUMNS = ['restaurant_name', 'neighborhood', 'cuisine_type']
+
+# (output column, validated compass/google-maps-reviews-scraper field, default)
+REVIEW_FIELDS = [
+    ('reviewer_name', 'name', 'Anonymous'),
+    ('rating', 'stars', None),
+    ('review_text', 'text', ''),
+    ('review_text_translated', 'textTranslated', ''),
+    ('published_date', 'publishedAtDate', 'Unknown'),
+    ('published_timestamp', 'publishAt', None),
+    ('likes_count', 'likesCount', 0),
+    ('reviewer_total_reviews', 'reviewerNumberOfReviews', 0),
+    ('is_local_guide', 'isLocalGuide', False),
+    ('owner_response', 'responseFromOwnerText', None),
+    ('review_id', 'reviewId', None),
+    ('review_url', 'reviewUrl', None),
+]
+
+
+class ErrorClass(IntEnum):
+    """How a failed Apify call is handled"""
+    CREDIT = 0       # Account is out of credits: drop the token, switch right away
+    RATE_LIMIT = 1   # Too many requests: cool the token down, back off and retry
+    TRANSIENT = 2    # Anything else that may go away: back off and retry
+    FATAL = 3        # Retrying can't help (e.g. the Actor rejected the input)
+
+
+def _normalize_url(url: str) -> str:
+    """URL form used to match a batched run's items back to their start URL"""
+    return url.strip().rstrip('/').lower()
+
+
+def _normalize_name(name: str) -> str:
+    """Restaurant name form used to match items by place title"""
+    return ' '.join(name.casefold().split())
+
 
 class ApifyMultiAccountScraper:
     """
@@ -33,137 +113,375 @@ class ApifyMultiAccountScraper:
     Automatically switches to next token when one runs out of credits
     """
     
-    # Validated field names from Apify compass/google-maps-reviews-scraper output
-    FIELD_MAPPINGS = {
-        'name': 'name',
-        'stars': 'stars',
-        'text': 'text',
-        'textTranslated': 'textTranslated',
-        'publishedAtDate': 'publishedAtDate',
-        'publishAt': 'publishAt',
-        'likesCount': 'likesCount',
-        'reviewerNumberOfReviews': 'reviewerNumberOfReviews',
-        'responseFromOwnerText': 'responseFromOwnerText',
-        'reviewId': 'reviewId',
-        'reviewUrl': 'reviewUrl',
-        'isLocalGuide': 'isLocalGuide',
-    }
-    
-    def __init__(self, api_tokens: List[str], max_retries: int = 3):
+    # Error messages that mean the account is out of credits
+    _CREDIT_ERR_RE = re.compile(
+        r'insufficient credits|not enough credits|credit limit|payment required|quota exceeded',
+        re.IGNORECASE
+    )
+    # Error messages that mean the same request will keep failing
+    _FATAL_ERR_RE = re.compile(r'input is not valid|invalid input', re.IGNORECASE)
+    
+    def __init__(
+        self,
+        api_tokens: List[str],
+        max_retries: int = 3,
+        progress_file: str = "reviews_progress.csv",
+        cache_dir: Optional[str] = CACHE_DIR,
+        cache_ttl_days: float = CACHE_TTL_DAYS
+    ):
         """
         Initialize with multiple API tokens
         
         Args:
             api_tokens: List of Apify API tokens from different accounts
             max_retries: Maximum number of retries for failed requests
+            progress_file: CSV that each scraped restaurant is appended to
+            cache_dir: Directory for cached actor results (None disables the cache)
+            cache_ttl_days: Cached results older than this are scraped again
         """
         if not api_tokens or len(api_tokens) == 0:
             raise ValueError("At least one API token is required")
             
         self.api_tokens = api_tokens
-        self.current_token_index = 0
-        self.clients = [ApifyClient(token) for token in api_tokens]
-        self.all_reviews = []
+        # One async client per account; each keeps its own keep-alive connection pool
+        self.clients = [ApifyClientAsync(token) for token in api_tokens]
+        self._batches: List[pa.RecordBatch] = []
+        self.total_reviews = 0
+        self._df_cache: Optional[pd.DataFrame] = None
         self.max_retries = max_retries
         self.tokens_exhausted = set()
+        # Estimated credits left per token (free tier until refresh_credits() fetches them)
+        # and actor runs currently running on it; together they drive token selection
+        self.token_credits = [5.0] * len(api_tokens)
+        self.token_inflight = [0] * len(api_tokens)
+        # time.monotonic() until which each token is skipped after a rate limit
+        self._cooldowns = [0.0] * len(api_tokens)
+        self.progress_file = progress_file
+        self._progress_writer = None
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl_days * 24 * 3600
+        self.cache_hits = 0
+        self._error_handlers = {
+            ErrorClass.CREDIT: self._handle_credit_error,
+            ErrorClass.RATE_LIMIT: self._handle_rate_limit,
+            ErrorClass.TRANSIENT: self._handle_transient_error,
+            ErrorClass.FATAL: self._handle_fatal_error,
+        }
         
         logger.info(f"Initialized with {len(api_tokens)} Apify accounts")
         logger.info(f"Estimated capacity: ~{len(api_tokens) * 10000} reviews")
         logger.info(f"Max retries per request: {max_retries}")
     
-    def check_token_credits(self, client: ApifyClient, token_index: int) -> bool:
+    async def check_token_credits(self, client: ApifyClientAsync, token_index: int) -> bool:
         try:
-            user_info = client.user().get()
-            available_credits = (
-                user_info.get('usage', {}).get('availableCredits') or
-                user_info.get('availableCredits') or
-                5.0  # Asume crédito inicial por default
-            )
+            user_info = await client.user().get()
+            available_credits = user_info.get('usage', {}).get('availableCredits')
+            if available_credits is None:
+                available_credits = user_info.get('availableCredits')
+            if available_credits is None:
+                available_credits = 5.0  # Asume crédito inicial por default
             logger.info(f"Account #{token_index + 1} has ${available_credits:.2f} credits remaining")
+            self.token_credits[token_index] = available_credits
             return available_credits > 0.1
         except Exception as e:
             logger.warning(f"Could not fetch credits for account #{token_index + 1}: {e}")
             return True  # asumir que tiene crédito
 
     
-    def get_next_available_client(self, check_credits: bool = False) -> Optional[tuple]:
-        """Get next client that still has credits available"""
-        attempts = 0
-        max_attempts = len(self.clients)
+    def _token_score(self, token_index: int) -> float:
+        """Estimated credits left, minus a penalty for each run the token already has in flight"""
+        return self.token_credits[token_index] - INFLIGHT_PENALTY * self.token_inflight[token_index]
+    
+    async def refresh_credits(self):
+        """Fetch every usable token's balance at once, marking the ones without credits as exhausted"""
+        usable = [i for i in range(len(self.clients)) if i not in self.tokens_exhausted]
+        has_credits = await asyncio.gather(
+            *(self.check_token_credits(self.clients[i], i) for i in usable)
+        )
+        for token_index, ok in zip(usable, has_credits):
+            if not ok:
+                self.tokens_exhausted.add(token_index)
+                logger.warning(f"Account #{token_index + 1} marked as exhausted")
+    
+    def get_next_available_client(self) -> Optional[tuple]:
+        """Get the client with the best credits/in-flight score (not exhausted, not cooling down)"""
+        # Balances come from refresh_credits() and credit errors, not a probe per retry;
+        # nothing here awaits, so workers can't interleave while a token is being picked
+        now = time.monotonic()
+        usable = [i for i in range(len(self.clients)) if i not in self.tokens_exhausted]
+        ready = [i for i in usable if self._cooldowns[i] <= now]
+        if ready:
+            token_index = max(ready, key=self._token_score)
+            return self.clients[token_index], token_index
         
-        while attempts < max_attempts:
-            if self.current_token_index in self.tokens_exhausted:
-                logger.info(f"Skipping account #{self.current_token_index + 1} (exhausted)")
-                self.current_token_index = (self.current_token_index + 1) % len(self.clients)
-                attempts += 1
-                continue
-            
-            client = self.clients[self.current_token_index]
-            token_index = self.current_token_index
-            
-            if check_credits:
-                if self.check_token_credits(client, token_index):
-                    self.current_token_index = (self.current_token_index + 1) % len(self.clients)
-                    return client, token_index
-                else:
-                    self.tokens_exhausted.add(token_index)
-                    logger.warning(f"Account #{token_index + 1} marked as exhausted")
-                    self.current_token_index = (self.current_token_index + 1) % len(self.clients)
-                    attempts += 1
-            else:
-                self.current_token_index = (self.current_token_index + 1) % len(self.clients)
-                return client, token_index
+        cooling = [i for i in usable if self._cooldowns[i] > now]
+        if cooling:
+            # Every usable token is rate limited; take the one that recovers first
+            token_index = min(cooling, key=lambda i: self._cooldowns[i])
+            logger.info(f"All available accounts cooling down, using account #{token_index + 1}")
+            return self.clients[token_index], token_index
         
         logger.error("ALL API TOKENS EXHAUSTED - No more credits available")
         return None
     
-    def _safe_get_field(self, item: Dict, field: str, default=None):
-        """Safely extract field from item dict with fallback"""
-        return item.get(field, default)
+    def _items_to_batch(
+        self,
+        items: List[Dict],
+        restaurant_name: str,
+        neighborhood: str,
+        cuisine_type: str,
+        place_url: str
+    ) -> pa.RecordBatch:
+        """Extract one page of dataset items into column lists and build a RecordBatch"""
+        n = len(items)
+        columns = {name: [] for name in REVIEW_SCHEMA.names}
+        columns['restaurant_name'] = [restaurant_name] * n
+        columns['neighborhood'] = [neighborhood] * n
+        columns['cuisine_type'] = [cuisine_type] * n
+        columns['place_url'] = [place_url] * n
+        
+        # Bind the column appends once so the per-item loop is plain dict.get calls
+        extractors = [(columns[out_key].append, field, default) for out_key, field, default in REVIEW_FIELDS]
+        for item in items:
+            for append, field, default in extractors:
+                append(item.get(field, default))
+        # review_length comes from the Arrow text column instead of a second Python pass
+        review_text = pa.array(columns['review_text'], pa.string())
+        columns['review_text'] = review_text
+        columns['review_length'] = pc.fill_null(pc.utf8_length(review_text), 0).cast(pa.int64())
+        
+        return pa.RecordBatch.from_pydict(columns, schema=REVIEW_SCHEMA)
+    
+    def _with_restaurant(self, batch: pa.RecordBatch, restaurant: Dict) -> pa.RecordBatch:
+        """Replace a batch's restaurant columns with this restaurant's name, neighborhood, cuisine and URL"""
+        values = {
+            'restaurant_name': restaurant['name'],
+            'neighborhood': restaurant['neighborhood'],
+            'cuisine_type': restaurant.get('cuisine_type', 'Unknown'),
+            'place_url': restaurant['url'],
+        }
+        arrays = [
+            pa.repeat(pa.scalar(values[field.name], field.type), batch.num_rows) if field.name in values else column
+            for field, column in zip(REVIEW_SCHEMA, batch.columns)
+        ]
+        return pa.RecordBatch.from_arrays(arrays, schema=REVIEW_SCHEMA)
+    
+    def _add_batches(self, batches: List[pa.RecordBatch]):
+        """Store a restaurant's review batches and append them to the progress CSV"""
+        # No awaits in here, so workers on the event loop can't interleave
+        self._batches.extend(batches)
+        self.total_reviews += sum(batch.num_rows for batch in batches)
+        self._df_cache = None
+        try:
+            if self._progress_writer is None:
+                self._progress_writer = pa_csv.CSVWriter(self.progress_file, REVIEW_SCHEMA)
+            for batch in batches:
+                self._progress_writer.write_batch(batch)
+        except Exception as e:
+            logger.warning(f"Could not write progress to {self.progress_file}: {e}")
+    
+    def _table(self) -> pa.Table:
+        """All collected reviews as a single Arrow table"""
+        return pa.Table.from_batches(self._batches, schema=REVIEW_SCHEMA)
+    
+    def _as_df(self) -> pd.DataFrame:
+        """Collected reviews as an Arrow-backed DataFrame, cached until the next scrape"""
+        if self._df_cache is None:
+            self._df_cache = self._table().to_pandas(types_mapper=pd.ArrowDtype)
+        return self._df_cache
+    
+    def close_progress(self):
+        """Close the progress CSV writer, if open"""
+        if self._progress_writer is not None:
+            self._progress_writer.close()
+            self._progress_writer = None
+    
+    def _cache_path(self, place_url: str, sort_by: str, max_reviews: int) -> str:
+        """Cache file for one actor run, keyed by everything that changes its output"""
+        key = f"{place_url}|{sort_by}|{max_reviews}".encode('utf-8')
+        return os.path.join(self.cache_dir, hashlib.blake2b(key, digest_size=16).hexdigest() + ".parquet")
+    
+    def _load_cached(self, cache_path: str) -> Optional[pa.Table]:
+        """Read a cached run if it exists and is within the TTL"""
+        try:
+            if time.time() - os.path.getmtime(cache_path) > self.cache_ttl:
+                return None
+            return pq.read_table(cache_path, schema=REVIEW_SCHEMA)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not read cache file {cache_path}: {e}")
+            return None
+    
+    def _save_cached(self, cache_path: str, batches: List[pa.RecordBatch]):
+        """Write a freshly scraped restaurant to the cache"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            pq.write_table(pa.Table.from_batches(batches, schema=REVIEW_SCHEMA), cache_path, compression='zstd')
+        except Exception as e:
+            logger.warning(f"Could not write cache file {cache_path}: {e}")
     
     def _is_credit_error(self, error_message: str) -> bool:
         """Check if error is related to insufficient credits"""
-        credit_error_keywords = [
-            'insufficient credits',
-            'not enough credits',
-            'credit limit',
-            'payment required',
-            'quota exceeded'
-        ]
-        
+        return bool(self._CREDIT_ERR_RE.search(str(error_message)))
+    
+    def _is_rate_limit_error(self, error_message: str) -> bool:
+        """Check if error is an API rate limit (HTTP 429)"""
         error_lower = str(error_message).lower()
-        return any(keyword in error_lower for keyword in credit_error_keywords)
+        return any(keyword in error_lower for keyword in ('rate limit', 'too many requests', '429'))
     
-    def scrape_restaurant_reviews(
+    def _classify_error(self, error: Exception) -> ErrorClass:
+        """Map an Apify client error to how it should be handled"""
+        # API errors carry the HTTP status; only fall back to the message when it is ambiguous
+        if isinstance(error, ApifyApiError):
+            status = error.status_code
+            if status in (402, 403):
+                return ErrorClass.CREDIT
+            if status == 429:
+                return ErrorClass.RATE_LIMIT
+            if status >= 500:
+                return ErrorClass.TRANSIENT
+            if status == 400 and error.type == 'invalid-input':
+                return ErrorClass.FATAL
+        
+        error_message = str(error)
+        if self._is_credit_error(error_message):
+            return ErrorClass.CREDIT
+        if self._is_rate_limit_error(error_message):
+            return ErrorClass.RATE_LIMIT
+        if self._FATAL_ERR_RE.search(error_message):
+            return ErrorClass.FATAL
+        return ErrorClass.TRANSIENT
+    
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Exponential backoff with full jitter, so parallel workers don't retry in lockstep"""
+        return random.uniform(0, 2 ** attempt)
+    
+    async def _retry_after(self, attempt: int, wait_time: float, label: str) -> bool:
+        """Sleep before the next attempt; False when no attempts are left"""
+        if attempt < self.max_retries - 1:
+            logger.info(f"Retrying in {wait_time:.1f} seconds...")
+            await asyncio.sleep(wait_time)
+            return True
+        logger.error(f"Failed after {self.max_retries} attempts for {label}")
+        return False
+    
+    # Error handlers: return True to make another attempt, False to give up
+    
+    async def _handle_credit_error(self, attempt: int, token_index: Optional[int], label: str) -> bool:
+        if token_index is not None:
+            logger.warning(f"Account #{token_index + 1} ran out of credits")
+            self.tokens_exhausted.add(token_index)
+            self.token_credits[token_index] = 0.0
+        
+        if len(self.tokens_exhausted) >= len(self.clients):
+            logger.error("All tokens exhausted - cannot continue")
+            return False
+        
+        logger.info("Switching to next available token...")
+        return True
+    
+    async def _handle_rate_limit(self, attempt: int, token_index: Optional[int], label: str) -> bool:
+        wait_time = self._backoff(attempt)
+        if token_index is not None:
+            self._cooldowns[token_index] = time.monotonic() + wait_time
+            logger.warning(f"Account #{token_index + 1} rate limited, cooling down for {wait_time:.1f} seconds")
+        return await self._retry_after(attempt, wait_time, label)
+    
+    async def _handle_transient_error(self, attempt: int, token_index: Optional[int], label: str) -> bool:
+        return await self._retry_after(attempt, self._backoff(attempt), label)
+    
+    async def _handle_fatal_error(self, attempt: int, token_index: Optional[int], label: str) -> bool:
+        logger.error(f"Error is not retryable, giving up on {label}")
+        return False
+    
+    def _route_items(self, items: List[Dict], targets: List[List[int]], lookup: Dict[str, int]) -> tuple:
+        """Group one page of a batched run's items by the start URL they belong to"""
+        if len(targets) == 1:
+            return {0: items}, 0
+        
+        groups: Dict[int, List[Dict]] = {}
+        unmatched = 0
+        for item in items:
+            get = item.get
+            index = lookup.get(_normalize_url(get('url') or ''))
+            if index is None:
+                index = lookup.get(get('placeId'))
+            if index is None:
+                index = lookup.get(_normalize_name(get('title') or ''))
+            if index is None:
+                unmatched += 1
+                continue
+            if get('placeId'):
+                # Later items of the same place match on placeId even if url/title differ
+                lookup[get('placeId')] = index
+            groups.setdefault(index, []).append(item)
+        return groups, unmatched
+    
+    async def scrape_restaurant_batch(
         self,
-        place_url: str,
-        restaurant_name: str,
-        neighborhood: str,
-        cuisine_type: str = "Unknown",
+        restaurants: List[Dict],
         max_reviews: int = 100,
-        sort_by: str = "newest"
-    ) -> List[Dict]:
+        sort_by: str = "newest",
+        preferred_token: Optional[int] = None
+    ) -> List[int]:
         """
-        Scrape reviews from a single restaurant using Apify with retry logic
+        Scrape several restaurants with a single Actor run (all of them in startUrls)
         
         Args:
-            place_url: Google Maps URL of the restaurant
-            restaurant_name: Name of the restaurant
-            neighborhood: Neighborhood (Upper East Side, Hell's Kitchen, etc.)
-            cuisine_type: Type of cuisine
-            max_reviews: Maximum number of reviews to scrape
+            restaurants: Dicts with 'url', 'name', 'neighborhood' and optionally 'cuisine_type'
+            max_reviews: Maximum number of reviews to scrape per restaurant
             sort_by: "newest", "mostRelevant", "highestRanking", "lowestRanking"
+            preferred_token: Account to use on the first attempt (retries rotate)
         
         Returns:
-            List of review dictionaries
+            Number of reviews collected for each restaurant, in the same order (0 on failure)
         """
+        counts = [0] * len(restaurants)
         logger.info("=" * 60)
-        logger.info(f"Scraping: {restaurant_name} ({neighborhood})")
+        if len(restaurants) == 1:
+            logger.info(f"Scraping: {restaurants[0]['name']} ({restaurants[0]['neighborhood']})")
+        else:
+            logger.info(f"Scraping batch of {len(restaurants)}: {', '.join(r['name'] for r in restaurants)}")
         logger.info("=" * 60)
         
-        # Configure the scraper input
+        # Skip the actor run entirely for restaurants that were scraped recently
+        pending, pending_slots, cache_paths = [], [], []
+        for slot, restaurant in enumerate(restaurants):
+            cache_path = None
+            if self.cache_dir:
+                cache_path = self._cache_path(restaurant['url'], sort_by, max_reviews)
+                cached = self._load_cached(cache_path)
+                if cached is not None and cached.num_rows:
+                    self.cache_hits += 1
+                    logger.info(f"Cache hit for {restaurant['name']}: {cached.num_rows} reviews loaded, no actor run needed")
+                    # The cache is keyed by URL only; another restaurant sharing the URL may have written it
+                    self._add_batches([self._with_restaurant(batch, restaurant) for batch in cached.to_batches()])
+                    counts[slot] = cached.num_rows
+                    continue
+            pending.append(restaurant)
+            pending_slots.append(slot)
+            cache_paths.append(cache_path)
+        
+        if not pending:
+            return counts
+        
+        label = pending[0]['name'] if len(pending) == 1 else f"batch of {len(pending)} restaurants"
+        
+        # Restaurants sharing a URL are sent once; the reviews are copied to each of them
+        targets: List[List[int]] = []
+        target_of_url: Dict[str, int] = {}
+        for index, restaurant in enumerate(pending):
+            url_key = _normalize_url(restaurant['url'])
+            if url_key not in target_of_url:
+                target_of_url[url_key] = len(targets)
+                targets.append([])
+            targets[target_of_url[url_key]].append(index)
+        
+        # Configure the scraper input (maxReviews applies to each place)
         run_input = {
-            "startUrls": [{"url": place_url}],
+            "startUrls": [{"url": pending[members[0]]['url']} for members in targets],
             "maxReviews": max_reviews,
             "reviewsSort": sort_by,
             "language": "en",
@@ -173,221 +491,321 @@ class ApifyMultiAccountScraper:
         
         # Retry logic with automatic token switching
         for attempt in range(self.max_retries):
+            token_index = None
             try:
-                # Get next available client
-                check_credits_now = (attempt > 0)
-                client_info = self.get_next_available_client(check_credits=check_credits_now)
+                # Get next available client (the worker's own account first)
+                if (attempt == 0 and preferred_token is not None
+                        and preferred_token not in self.tokens_exhausted
+                        and self._cooldowns[preferred_token] <= time.monotonic()):
+                    client_info = (self.clients[preferred_token], preferred_token)
+                else:
+                    client_info = self.get_next_available_client()
                 
                 if client_info is None:
                     logger.error("Cannot continue - all tokens exhausted")
-                    logger.error(f"Failed to scrape {restaurant_name}")
-                    return []
+                    logger.error(f"Failed to scrape {label}")
+                    return counts
                 
                 client, token_index = client_info
                 logger.info(f"Attempt {attempt + 1}/{self.max_retries} using account #{token_index + 1}")
                 
                 # Run the Actor and wait for completion
-                run = client.actor("compass/google-maps-reviews-scraper").call(run_input=run_input)
+                self.token_inflight[token_index] += 1
+                try:
+                    run = await client.actor("compass/google-maps-reviews-scraper").call(run_input=run_input)
+                finally:
+                    self.token_inflight[token_index] -= 1
                 
                 if not run or 'defaultDatasetId' not in run:
                     logger.error("Invalid response from Apify actor")
-                    if attempt < self.max_retries - 1:
-                        logger.info(f"Retrying in {2 ** attempt} seconds...")
-                        time.sleep(2 ** attempt)
+                    if await self._retry_after(attempt, self._backoff(attempt), label):
                         continue
-                    else:
-                        logger.error(f"Failed after {self.max_retries} attempts")
-                        return []
+                    return counts
                 
                 logger.info(f"Scraper completed. Dataset ID: {run['defaultDatasetId']}")
+                self.token_credits[token_index] -= len(targets) * max_reviews / 1000 * COST_PER_1000_REVIEWS
                 
                 # FIXED: Fetch results using list_items() instead of iterate_items()
-                reviews_data = []
+                # Pages of REVIEW_CHUNK_SIZE items are turned into Arrow batches right away,
+                # so only one page of raw dicts is alive at a time
+                batches: List[List[pa.RecordBatch]] = [[] for _ in targets]
+                lookup = dict(target_of_url)
+                ambiguous = set()
+                for target, members in enumerate(targets):
+                    for index in members:
+                        for key in (_normalize_name(pending[index]['name']), pending[index].get('place_id')):
+                            if key and lookup.setdefault(key, target) != target:
+                                ambiguous.add(key)
+                for key in ambiguous:
+                    # A name or placeId shared by different URLs can't tell their items apart
+                    del lookup[key]
                 dataset_client = client.dataset(run['defaultDatasetId'])
                 
                 try:
-                    # Use list_items() which returns a ListPage object
-                    dataset_result = dataset_client.list_items()
-                    items = dataset_result.items  # Direct access, not .get()
-                    
-                    if not items:
-                        logger.warning(f"No reviews found in dataset for {restaurant_name}")
-                        return []
+                    offset = 0
+                    unmatched = over_limit = 0
+                    collected = [0] * len(targets)
+                    # Never fetch past what was asked for, even if the Actor over-delivers: stop
+                    # once every restaurant is full (a single restaurant never requests the tail)
+                    while min(collected) < max_reviews:
+                        page_size = REVIEW_CHUNK_SIZE
+                        if len(targets) == 1:
+                            page_size = min(page_size, max_reviews - offset)
+                        # Use list_items() which returns a ListPage object
+                        items = (await dataset_client.list_items(offset=offset, limit=page_size)).items
+                        if items:
+                            groups, page_unmatched = self._route_items(items, targets, lookup)
+                            unmatched += page_unmatched
+                            for index, group in groups.items():
+                                room = max_reviews - collected[index]
+                                over_limit += max(len(group) - room, 0)
+                                if room <= 0:
+                                    continue
+                                group = group[:room]
+                                collected[index] += len(group)
+                                restaurant = pending[targets[index][0]]
+                                batches[index].append(self._items_to_batch(
+                                    group, restaurant['name'], restaurant['neighborhood'],
+                                    restaurant.get('cuisine_type', 'Unknown'), restaurant['url']
+                                ))
+                            offset += len(items)
+                        if len(items) < page_size:
+                            break
                     
-                    logger.info(f"Found {len(items)} items in dataset")
+                    if not offset:
+                        logger.warning(f"No reviews found in dataset for {label}")
+                        return counts
                     
-                    for item in items:
-                        # Extract and structure the review data
-                        review = {
-                            'restaurant_name': restaurant_name,
-                            'neighborhood': neighborhood,
-                            'cuisine_type': cuisine_type,
-                            'place_url': place_url,
-                            'reviewer_name': self._safe_get_field(item, 'name', 'Anonymous'),
-                            'rating': self._safe_get_field(item, 'stars'),
-                            'review_text': self._safe_get_field(item, 'text', ''),
-                            'review_text_translated': self._safe_get_field(item, 'textTranslated', ''),
-                            'review_length': len(self._safe_get_field(item, 'text', '') or ''),
-                            'published_date': self._safe_get_field(item, 'publishedAtDate', 'Unknown'),
-                            'published_timestamp': self._safe_get_field(item, 'publishAt'),
-                            'likes_count': self._safe_get_field(item, 'likesCount', 0),
-                            'reviewer_total_reviews': self._safe_get_field(item, 'reviewerNumberOfReviews', 0),
-                            'is_local_guide': self._safe_get_field(item, 'isLocalGuide', False),
-                            'owner_response': self._safe_get_field(item, 'responseFromOwnerText'),
-                            'review_id': self._safe_get_field(item, 'reviewId'),
-                            'review_url': self._safe_get_field(item, 'reviewUrl'),
-                        }
-                        reviews_data.append(review)
+                    logger.info(f"Found {offset} items in dataset")
+                    if unmatched:
+                        logger.warning(f"Dropped {unmatched} items that matched no restaurant in the batch")
+                    if over_limit:
+                        logger.warning(f"Dropped {over_limit} items beyond {max_reviews} reviews per restaurant")
                     
-                    logger.info(f"Successfully extracted {len(reviews_data)} reviews from {restaurant_name}")
-                    self.all_reviews.extend(reviews_data)
+                    # Committed only once the whole dataset was read, so a retry never duplicates rows
+                    for target, members in enumerate(targets):
+                        found = collected[target]
+                        for index in members:
+                            restaurant = pending[index]
+                            if not found:
+                                logger.warning(f"No reviews found in dataset for {restaurant['name']}")
+                                continue
+                            logger.info(f"Successfully extracted {found} reviews from {restaurant['name']}")
+                            restaurant_batches = batches[target]
+                            if index != members[0]:
+                                restaurant_batches = [self._with_restaurant(batch, restaurant) for batch in restaurant_batches]
+                            self._add_batches(restaurant_batches)
+                            if cache_paths[index]:
+                                self._save_cached(cache_paths[index], restaurant_batches)
+                            counts[pending_slots[index]] = found
                     
-                    return reviews_data
+                    return counts
                     
                 except Exception as e:
                     logger.error(f"Error processing dataset: {e}")
-                    if attempt < self.max_retries - 1:
-                        logger.info(f"Retrying in {2 ** attempt} seconds...")
-                        time.sleep(2 ** attempt)
+                    if await self._retry_after(attempt, self._backoff(attempt), label):
                         continue
-                    else:
-                        logger.error(f"Failed to process dataset after {self.max_retries} attempts")
-                        return []
+                    return counts
                 
             except Exception as e:
                 error_msg = str(e)
                 logger.error(f"Apify client error on attempt {attempt + 1}: {error_msg}")
-
-                if self._is_credit_error(error_msg):
-                    try:
-                        logger.warning(f"Account #{token_index + 1} ran out of credits")
-                        self.tokens_exhausted.add(token_index)
-                    except Exception:
-                        logger.warning("Could not mark token as exhausted")
-
-                    if len(self.tokens_exhausted) >= len(self.clients):
-                        logger.error("All tokens exhausted - cannot continue")
-                        return []
-
-                    logger.info("Switching to next available token...")
-                    continue
-
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt
-                    logger.info(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"Failed after {self.max_retries} attempts for {restaurant_name}")
-                    return []
+                
+                handler = self._error_handlers[self._classify_error(e)]
+                if not await handler(attempt, token_index, label):
+                    return counts
         
-        return []
+        return counts
     
-    def scrape_multiple_restaurants(
+    async def scrape_restaurant_reviews(
+        self,
+        place_url: str,
+        restaurant_name: str,
+        neighborhood: str,
+        cuisine_type: str = "Unknown",
+        max_reviews: int = 100,
+        sort_by: str = "newest",
+        preferred_token: Optional[int] = None
+    ) -> int:
+        """
+        Scrape reviews from a single restaurant using Apify with retry logic
+        
+        Args:
+            place_url: Google Maps URL of the restaurant
+            restaurant_name: Name of the restaurant
+            neighborhood: Neighborhood (Upper East Side, Hell's Kitchen, etc.)
+            cuisine_type: Type of cuisine
+            max_reviews: Maximum number of reviews to scrape
+            sort_by: "newest", "mostRelevant", "highestRanking", "lowestRanking"
+            preferred_token: Account to use on the first attempt (retries rotate)
+        
+        Returns:
+            Number of reviews collected (0 on failure)
+        """
+        restaurant = {
+            'url': place_url,
+            'name': restaurant_name,
+            'neighborhood': neighborhood,
+            'cuisine_type': cuisine_type,
+        }
+        counts = await self.scrape_restaurant_batch([restaurant], max_reviews, sort_by, preferred_token)
+        return counts[0]
+    
+    async def scrape_multiple_restaurants(
         self,
         restaurants: List[Dict],
         reviews_per_restaurant: int = 100,
         delay_between_requests: tuple = (3, 7),
-        save_interval: int = 5
-    ) -> List[Dict]:
-        """Scrape reviews from multiple restaurants"""
+        save_interval: int = 5,
+        batch_size: int = 1
+    ) -> pa.Table:
+        """Scrape reviews from multiple restaurants, one concurrent worker per account
+        
+        With batch_size > 1 several restaurants share one Actor run, but its reviews can
+        only be attributed back by URL, placeId or name; links the Actor doesn't echo
+        back (e.g. google.com/search URLs) lose their reviews, so the default is one per run
+        """
         total_restaurants = len(restaurants)
         logger.info("#" * 60)
         logger.info(f"Starting batch scrape of {total_restaurants} restaurants")
         logger.info(f"Target: ~{total_restaurants * reviews_per_restaurant} reviews")
         logger.info("#" * 60)
         
-        successful_scrapes = 0
-        failed_scrapes = 0
+        # Shared queue: each account's worker pulls the next batch when it is free
+        queue: asyncio.Queue = asyncio.Queue()
+        for start in range(0, total_restaurants, batch_size):
+            queue.put_nowait(restaurants[start:start + batch_size])
+        await self.refresh_credits()
+        active_tokens = [i for i in range(len(self.clients)) if i not in self.tokens_exhausted]
+        counts = {'done': 0, 'successful': 0, 'failed': 0}
         
-        for i, restaurant in enumerate(restaurants):
-            logger.info(f"[{i+1}/{total_restaurants}] Processing restaurant...")
-            
-            if len(self.tokens_exhausted) >= len(self.clients):
-                logger.error("ALL TOKENS EXHAUSTED - Stopping scraper")
-                logger.info(f"Collected {len(self.all_reviews)} reviews before running out of credits")
-                break
-            
-            reviews = self.scrape_restaurant_reviews(
-                place_url=restaurant['url'],
-                restaurant_name=restaurant['name'],
-                neighborhood=restaurant['neighborhood'],
-                cuisine_type=restaurant.get('cuisine_type', 'Unknown'),
-                max_reviews=reviews_per_restaurant,
-                sort_by="newest"
-            )
-            
-            if reviews:
-                successful_scrapes += 1
-            else:
-                failed_scrapes += 1
-                logger.warning(f"No reviews collected from {restaurant['name']}")
-            
-            # Save progress at intervals
-            if (i + 1) % save_interval == 0:
-                self.save_to_csv(f"reviews_progress_{i+1}.csv")
-                logger.info(f"Progress saved: {successful_scrapes} successful, {failed_scrapes} failed")
-                logger.info(f"Tokens exhausted: {len(self.tokens_exhausted)}/{len(self.clients)}")
-            
-            # Random delay
-            if i < total_restaurants - 1:
-                delay = random.uniform(*delay_between_requests)
-                logger.info(f"Waiting {delay:.1f} seconds before next restaurant...")
-                time.sleep(delay)
+        async def worker(token_index: int):
+            while not queue.empty():
+                if len(self.tokens_exhausted) >= len(self.clients):
+                    logger.error("ALL TOKENS EXHAUSTED - Stopping scraper")
+                    logger.info(f"Collected {self.total_reviews} reviews before running out of credits")
+                    return
+                if token_index in self.tokens_exhausted:
+                    logger.info(f"Account #{token_index + 1} exhausted, stopping its worker")
+                    return
+                
+                batch = queue.get_nowait()
+                batch_counts = await self.scrape_restaurant_batch(
+                    batch,
+                    max_reviews=reviews_per_restaurant,
+                    sort_by="newest",
+                    preferred_token=token_index
+                )
+                
+                done_before = counts['done']
+                for restaurant, reviews in zip(batch, batch_counts):
+                    counts['done'] += 1
+                    counts['successful' if reviews else 'failed'] += 1
+                    if not reviews:
+                        logger.warning(f"No reviews collected from {restaurant['name']}")
+                logger.info(f"[{counts['done']}/{total_restaurants}] Finished batch of {len(batch)} on account #{token_index + 1}")
+                
+                # Progress is streamed to progress_file; report it at intervals
+                if counts['done'] // save_interval > done_before // save_interval:
+                    logger.info(f"Progress in {self.progress_file}: {counts['successful']} successful, {counts['failed']} failed")
+                    logger.info(f"Tokens exhausted: {len(self.tokens_exhausted)}/{len(self.clients)}")
+                
+                # Random delay (only throttles this worker's account)
+                if not queue.empty():
+                    delay = random.uniform(*delay_between_requests)
+                    logger.info(f"Account #{token_index + 1} waiting {delay:.1f} seconds before next batch...")
+                    await asyncio.sleep(delay)
+        
+        if active_tokens:
+            await asyncio.gather(*(worker(token_index) for token_index in active_tokens))
+        else:
+            logger.error("ALL TOKENS EXHAUSTED - Stopping scraper")
+        
+        successful_scrapes, failed_scrapes = counts['successful'], counts['failed']
+        
+        self.close_progress()
         
         logger.info("#" * 60)
         logger.info("SCRAPING COMPLETE")
-        logger.info(f"Total reviews collected: {len(self.all_reviews)}")
+        logger.info(f"Total reviews collected: {self.total_reviews}")
         logger.info(f"Successful restaurants: {successful_scrapes}/{total_restaurants}")
         logger.info(f"Failed restaurants: {failed_scrapes}/{total_restaurants}")
+        logger.info(f"Cache hits (actor runs skipped): {self.cache_hits}")
         logger.info(f"Tokens exhausted: {len(self.tokens_exhausted)}/{len(self.clients)}")
         logger.info("#" * 60)
         
-        return self.all_reviews
+        return self._table()
     
     def save_to_csv(self, filename: str = "manhattan_reviews.csv"):
         """Save all reviews to CSV"""
-        if self.all_reviews:
-            df = pd.DataFrame(self.all_reviews)
-            df.to_csv(filename, index=False, encoding='utf-8')
-            logger.info(f"Saved {len(self.all_reviews)} reviews to {filename}")
+        if self.total_reviews:
+            pa_csv.write_csv(self._table(), filename)
+            logger.info(f"Saved {self.total_reviews} reviews to {filename}")
         else:
             logger.warning("No reviews to save")
     
     def save_to_json(self, filename: str = "manhattan_reviews.json"):
         """Save all reviews to JSON"""
-        if self.all_reviews:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(self.all_reviews, f, indent=2, ensure_ascii=False)
-            logger.info(f"Saved {len(self.all_reviews)} reviews to {filename}")
+        if self.total_reviews:
+            with open(filename, 'wb') as f:
+                f.write(orjson.dumps(self._table().to_pylist(), option=orjson.OPT_INDENT_2))
+            logger.info(f"Saved {self.total_reviews} reviews to {filename}")
+        else:
+            logger.warning("No reviews to save")
+    
+    def save_to_parquet(self, filename: str = "manhattan_reviews.parquet"):
+        """Save all reviews to Parquet (zstd, repeated name columns dictionary-encoded)"""
+        if self.total_reviews:
+            table = self._table()
+            for name in DICTIONARY_COLUMNS:
+                table = table.set_column(
+                    table.schema.get_field_index(name), name, pc.dictionary_encode(table.column(name))
+                )
+            pq.write_table(table, filename, compression='zstd')
+            logger.info(f"Saved {self.total_reviews} reviews to {filename}")
         else:
             logger.warning("No reviews to save")
     
     def get_summary_stats(self) -> Optional[pd.DataFrame]:
         """Generate summary statistics"""
-        if not self.all_reviews:
+        if not self.total_reviews:
             logger.warning("No reviews collected yet")
             return None
         
-        df = pd.DataFrame(self.all_reviews)
+        df = self._as_df()
+        n = len(df)
+        
+        # One pass for the scalar stats and one groupby for both distributions
+        summary = df.agg({
+            'rating': 'mean',
+            'review_length': 'mean',
+            'owner_response': 'count',
+            'is_local_guide': 'sum',
+        })
+        # dropna=False so a row missing its cuisine still counts toward its neighborhood (and
+        # vice versa); the NA labels themselves are left out, as value_counts did
+        by_group = df.groupby(['neighborhood', 'cuisine_type'], dropna=False).size().unstack(fill_value=0)
+        by_neighborhood = by_group.sum(axis=1)
+        by_cuisine = by_group.sum(axis=0)
         
         logger.info("=" * 60)
         logger.info("SUMMARY STATISTICS")
         logger.info("=" * 60)
-        logger.info(f"Total reviews: {len(df)}")
+        logger.info(f"Total reviews: {n}")
         logger.info(f"\nReviews by neighborhood:")
-        logger.info(f"\n{df['neighborhood'].value_counts()}")
+        logger.info(f"\n{by_neighborhood[by_neighborhood.index.notna()].sort_values(ascending=False)}")
         logger.info(f"\nReviews by cuisine:")
-        logger.info(f"\n{df['cuisine_type'].value_counts()}")
+        logger.info(f"\n{by_cuisine[by_cuisine.index.notna()].sort_values(ascending=False)}")
         
-        valid_ratings = df['rating'].dropna()
-        if len(valid_ratings) > 0:
-            logger.info(f"\nAverage rating: {valid_ratings.mean():.2f}")
+        if pd.notna(summary['rating']):
+            logger.info(f"\nAverage rating: {summary['rating']:.2f}")
         else:
             logger.warning("\nNo valid ratings found")
             
-        logger.info(f"Average review length: {df['review_length'].mean():.1f} characters")
-        logger.info(f"Reviews with owner response: {df['owner_response'].notna().sum()} ({df['owner_response'].notna().sum()/len(df)*100:.1f}%)")
-        logger.info(f"Local guide reviews: {df['is_local_guide'].sum()} ({df['is_local_guide'].sum()/len(df)*100:.1f}%)")
+        logger.info(f"Average review length: {summary['review_length']:.1f} characters")
+        owner_responses, local_guides = int(summary['owner_response']), int(summary['is_local_guide'])
+        logger.info(f"Reviews with owner response: {owner_responses} ({owner_responses/n*100:.1f}%)")
+        logger.info(f"Local guide reviews: {local_guides} ({local_guides/n*100:.1f}%)")
         
         return df
 
@@ -419,16 +837,16 @@ if __name__ == "__main__":
     
     # STEP 4: Run the scraper
     try:
-        reviews = scraper.scrape_multiple_restaurants(
+        reviews = asyncio.run(scraper.scrape_multiple_restaurants(
             restaurants=restaurants,
             reviews_per_restaurant=50,
             delay_between_requests=(2, 5),
-            save_interval=5
-        )
+            save_interval=5,
+            batch_size=1
+        ))
         
-        # STEP 5: Save final results
-        scraper.save_to_csv("manhattan_reviews_final.csv")
-        scraper.save_to_json("manhattan_reviews_final.json")
+        # STEP 5: Save final results (export with save_to_csv / save_to_json if needed)
+        scraper.save_to_parquet("manhattan_reviews_final.parquet")
         
         # STEP 6: View summary
         df = scraper.get_summary_stats()
@@ -444,11 +862,12 @@ if __name__ == "__main__":
                 for idx, row in sample.iterrows():
                     rating_display = f"{row['rating']}" if pd.notna(row['rating']) else "N/A"
                     logger.info(f"  Rating: {rating_display} - {row['restaurant_name']}")
-                    review_preview = row['review_text'][:100] if row['review_text'] else "(No text)"
+                    review_preview = row['review_text'][:100] if pd.notna(row['review_text']) and row['review_text'] else "(No text)"
                     logger.info(f"    '{review_preview}...'")
                     
     except Exception as e:
         logger.error(f"Fatal error during scraping: {e}")
         logger.info("Attempting to save any collected data...")
+        scraper.close_progress()
         scraper.save_to_csv("manhattan_reviews_emergency_save.csv")
         raise
\ No newline at end of file